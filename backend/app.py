@@ -1,27 +1,56 @@
 import os
-import json
 import logging
-from flask import Flask, request, jsonify
+import multiprocessing
+from typing import Any
+
+import orjson
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+# Load environment variables before the custom modules read their settings
+load_dotenv()
+
 # Import custom modules
 from knowledge_base import KnowledgeBase
-from utils import setup_logging
-
-# Load environment variables
-load_dotenv()
+from utils import settings, setup_logging
 
 # Configure logging
 logger = setup_logging()
 
+class OrjsonProvider(JSONProvider):
+    """JSON provider that serializes responses with orjson, including NumPy arrays"""
+    
+    options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, option=self.options).decode()
+    
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+    
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        # Skip the bytes -> str -> bytes round trip of the default implementation
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self.options), mimetype="application/json")
+
 # Initialize Flask app
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)  # Enable CORS for all routes
 
 # Initialize knowledge base
 knowledge_base = KnowledgeBase()
 
+# Load the index at import time so a preloading gunicorn master does it once before forking.
+# Spawned document-parsing processes re-import this module and must not load it again.
+if os.environ.get("GUNICORN_WORKER") != "1" and multiprocessing.parent_process() is None:
+    try:
+        knowledge_base.initialize()
+    except Exception as e:
+        logger.error(f"Error during initial knowledge base setup: {str(e)}")
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Endpoint to check if the API is running"""
@@ -38,6 +67,15 @@ def initialize_kb():
         logger.error(f"Error initializing knowledge base: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def stream_answer(user_query):
+    """Generate server-sent events for a streamed answer"""
+    try:
+        for event, data in knowledge_base.ask_stream(user_query):
+            yield f"event: {event}\ndata: {app.json.dumps(data)}\n\n"
+    except Exception as e:
+        logger.error(f"Error streaming query: {str(e)}")
+        yield f"event: error\ndata: {app.json.dumps({'message': str(e)})}\n\n"
+
 @app.route('/api/query', methods=['POST'])
 def query():
     """Process a user query and return an answer"""
@@ -46,6 +84,14 @@ def query():
         if not user_query:
             return jsonify({"status": "error", "message": "Query is required"}), 400
         
+        # Stream sources and answer tokens as server-sent events when requested
+        if request.json.get('stream', False):
+            return Response(
+                stream_with_context(stream_answer(user_query)),
+                mimetype='text/event-stream',
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        
         # Get the answer from the knowledge base
         answer, sources = knowledge_base.ask(user_query)
         
@@ -68,12 +114,24 @@ def get_documents():
         logger.error(f"Error getting documents: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
-if __name__ == '__main__':
-    # Initialize the knowledge base on startup
+@app.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    """Get hit/miss counters for the query caches"""
     try:
-        knowledge_base.initialize()
+        return jsonify({"status": "success", "cache": knowledge_base.cache_stats()})
     except Exception as e:
-        logger.error(f"Error during initial knowledge base setup: {str(e)}")
-    
+        logger.error(f"Error getting cache stats: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Get query batching statistics"""
+    try:
+        return jsonify({"status": "success", "batching": knowledge_base.batching_metrics()})
+    except Exception as e:
+        logger.error(f"Error getting metrics: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+if __name__ == '__main__':
     # Run Flask app
-    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('DEBUG', 'False').lower() == 'true')
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=settings.debug)
\ No newline at end of file
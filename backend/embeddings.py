@@ -1,36 +1,308 @@
 import os
+import time
+import asyncio
+import hashlib
 import logging
-from typing import List, Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
 
-from langchain.embeddings import OpenAIEmbeddings
+import httpx
+import numpy as np
+import openai
 from langchain.embeddings.base import Embeddings
+from langchain_core.pydantic_v1 import PrivateAttr
+from langchain_openai import OpenAIEmbeddings
 
-from utils import get_env_variable
+from utils import settings
 
-class EmbeddingManager:
+def normalize_query(text: str) -> str:
+    """Normalize query text so trivially different phrasings share a cache entry"""
+    return " ".join(text.lower().split())
+
+def query_cache_key(text: str) -> str:
+    """Build a compact cache key from the normalized query text"""
+    return hashlib.blake2b(normalize_query(text).encode("utf-8"), digest_size=16).hexdigest()
+
+class QueryCache:
+    """Thread-safe LRU cache with a per-entry time-to-live"""
+    
+    def __init__(self, max_size: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        """Initialize the cache, reading limits from the environment when not given"""
+        if max_size is None:
+            max_size = settings.cache_size
+        if ttl_seconds is None:
+            ttl_seconds = settings.cache_ttl
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for a key, or None on a miss or expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if time.monotonic() - stored_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+    
+    def put(self, key: str, value: Any) -> None:
+        """Insert a value, evicting the least recently used entry when full"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        """Drop all cached entries"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and current occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    """Check whether an embedding API error is an HTTP 429 rate limit"""
+    status = getattr(error, "http_status", None) or getattr(error, "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+class _BackgroundEventLoop:
+    """Event loop on a daemon thread that lets sync code run coroutines on pooled connections"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._http_client = None
+    
+    def _ensure_started(self):
+        """Start the loop, again in a forked child where the parent's thread does not exist"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._loop = asyncio.new_event_loop()
+                self._http_client = None
+                threading.Thread(target=self._loop.run_forever, name="embedding-io", daemon=True).start()
+        return self._loop
+    
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """HTTP/2 client shared by every request made on this loop"""
+        self._ensure_started()
+        with self._lock:
+            if self._http_client is None:
+                max_connections = settings.embedding_max_connections
+                self._http_client = httpx.AsyncClient(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+                    timeout=httpx.Timeout(60.0, connect=10.0)
+                )
+            return self._http_client
+    
+    def run(self, coroutine) -> Any:
+        """Run a coroutine on the loop and block until it finishes"""
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+_io_loop = _BackgroundEventLoop()
+
+class PooledOpenAIEmbeddings(OpenAIEmbeddings):
+    """OpenAI embeddings sent over one pooled HTTP/2 connection set instead of per-call clients"""
+    
+    # Async client for the loop it was created on; rebuilt when a forked child starts a new loop
+    _client: Any = PrivateAttr(default=None)
+    _client_loop: Any = PrivateAttr(default=None)
+    
+    def _pooled_client(self) -> Any:
+        """Embeddings API resource bound to the shared HTTP client, created once per event loop"""
+        loop = asyncio.get_running_loop()
+        if self._client_loop is not loop:
+            client_params = {
+                "api_key": self.openai_api_key,
+                "organization": self.openai_organization,
+                "base_url": self.openai_api_base,
+                # The SDK retries timeouts, connection errors, 429 and 5xx responses itself,
+                # before async_embed_documents adds its own rate-limit backoff on top
+                "max_retries": self.max_retries,
+                "default_headers": self.default_headers,
+                "default_query": self.default_query,
+                "http_client": _io_loop.http_client
+            }
+            # Without an explicit timeout the shared client's own timeout applies
+            if self.request_timeout is not None:
+                client_params["timeout"] = self.request_timeout
+            self._client = openai.AsyncOpenAI(**client_params).embeddings
+            self._client_loop = loop
+        return self._client
+    
+    def embed_documents(self, texts: List[str], chunk_size: Optional[int] = 0) -> List[List[float]]:
+        """Generate embeddings for a list of documents over the pooled connections, chunk_size texts per request"""
+        chunk_size = chunk_size or self.chunk_size
+        batches = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        return _io_loop.run(self.async_embed_documents(batches))
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Generate the embedding for a single query over the pooled connections"""
+        return self.embed_documents([text])[0]
+    
+    async def async_embed_documents(self, batches: List[List[str]], max_concurrency: Optional[int] = None,
+                                    max_retries: Optional[int] = None) -> List[List[float]]:
+        """Embed batches concurrently, multiplexed over the shared client and limited by a semaphore"""
+        max_concurrency = max_concurrency or settings.embedding_max_workers
+        if max_retries is None:
+            max_retries = settings.embedding_max_retries
+        client = self._pooled_client()
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def embed_batch(batch: List[str]) -> List[List[float]]:
+            for attempt in range(max_retries + 1):
+                try:
+                    async with semaphore:
+                        response = await client.create(input=batch, model=self.model)
+                    return [item.embedding for item in response.data]
+                except Exception as e:
+                    # Rate limits that outlast the SDK's retries get a longer exponential backoff
+                    if not _is_rate_limit_error(e) or attempt == max_retries:
+                        raise
+                    await asyncio.sleep(2 ** attempt)
+        
+        results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+        return [vector for batch in results for vector in batch]
+
+# ONNX file produced by export_onnx_model.py for each precision
+ONNX_MODEL_FILES = {
+    "fp32": "model.onnx",
+    "fp16": "model_fp16.onnx",
+    "int8": "model_quantized.onnx"
+}
+
+# Longest input, in model tokens, the local sentence-transformer embeds before truncating
+ONNX_MAX_LENGTH = 256
+
+class LocalONNXEmbeddings(Embeddings):
+    """Sentence-transformer embeddings computed in-process with ONNX Runtime"""
+    
+    def __init__(self, model_path: str, precision: str = "int8", batch_size: int = 64, max_length: int = ONNX_MAX_LENGTH):
+        """Load the exported ONNX model and its tokenizer"""
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+        
+        if precision not in ONNX_MODEL_FILES:
+            raise ValueError(f"Unsupported embedding precision: {precision}")
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_path,
+            file_name=ONNX_MODEL_FILES[precision],
+            provider="CPUExecutionProvider"
+        )
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Generate the embedding for a single query"""
+        return self.embed_documents([text])[0]
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings, batching texts of similar length to minimize padding"""
+        if not texts:
+            return []
+        
+        # Tokenize everything in one call, then pad per batch
+        encoded = self.tokenizer(list(texts), truncation=True, max_length=self.max_length)
+        order = sorted(range(len(texts)), key=lambda i: len(encoded["input_ids"][i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch_ids = order[start:start + self.batch_size]
+            batch = self.tokenizer.pad(
+                {name: [values[i] for i in batch_ids] for name, values in encoded.items()},
+                return_tensors="np"
+            )
+            hidden = self.model(**batch).last_hidden_state
+            for i, vector in zip(batch_ids, self._pool(hidden, batch["attention_mask"])):
+                vectors[i] = vector.tolist()
+        return vectors
+    
+    @staticmethod
+    def _pool(hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """Mean-pool token states over the attention mask and L2-normalize"""
+        mask = attention_mask[..., None].astype(hidden.dtype)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+class EmbeddingManager(Embeddings):
     """Class to manage embeddings for the Transfer Pricing agent"""
     
     def __init__(self):
         """Initialize the embedding manager"""
         self.logger = logging.getLogger(__name__)
-        self.embedding_model = get_env_variable('EMBEDDING_MODEL', 'text-embedding-ada-002')
+        self.query_cache = QueryCache()
         self._embeddings = None
         
     @property
     def embeddings(self) -> Embeddings:
         """Get or initialize embeddings"""
         if self._embeddings is None:
-            self.logger.info(f"Initializing embeddings with model: {self.embedding_model}")
-            self._embeddings = OpenAIEmbeddings(model=self.embedding_model)
+            if settings.embedding_backend == 'onnx':
+                self.logger.info(f"Initializing local ONNX embeddings from {settings.onnx_model_path} ({settings.embedding_precision})")
+                self._embeddings = LocalONNXEmbeddings(settings.onnx_model_path, precision=settings.embedding_precision)
+            elif settings.embedding_backend == 'openai':
+                self.logger.info(f"Initializing embeddings with model: {settings.embedding_model}")
+                self._embeddings = PooledOpenAIEmbeddings(model=settings.embedding_model)
+            else:
+                raise ValueError(f"Unsupported embedding backend: {settings.embedding_backend}")
         return self._embeddings
     
     def embed_query(self, text: str) -> List[float]:
-        """Generate embeddings for a query text"""
+        """Generate embeddings for a query text, served from the query cache when possible"""
+        key = query_cache_key(text)
+        cached = self.query_cache.get(key)
+        if cached is not None:
+            return cached
         try:
-            return self.embeddings.embed_query(text)
+            embedding = self.embeddings.embed_query(text)
         except Exception as e:
             self.logger.error(f"Error generating query embedding: {str(e)}")
             raise
+        self.query_cache.put(key, embedding)
+        return embedding
+    
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for several queries, embedding all cache misses in one call"""
+        keys = [query_cache_key(text) for text in texts]
+        vectors = {key: self.query_cache.get(key) for key in set(keys)}
+        missing = {key: text for key, text in zip(keys, texts) if vectors[key] is None}
+        if missing:
+            try:
+                embedded = self.embeddings.embed_documents(list(missing.values()))
+            except Exception as e:
+                self.logger.error(f"Error generating query embeddings: {str(e)}")
+                raise
+            for key, embedding in zip(missing, embedded):
+                vectors[key] = embedding
+                self.query_cache.put(key, embedding)
+        return [vectors[key] for key in keys]
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """Generate embeddings for a list of documents"""
@@ -38,4 +310,39 @@ class EmbeddingManager:
             return self.embeddings.embed_documents(texts)
         except Exception as e:
             self.logger.error(f"Error generating document embeddings: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+    
+    def embed_documents_batched(self, texts: List[str], batch_size: Optional[int] = None,
+                                max_workers: Optional[int] = None) -> List[List[float]]:
+        """Generate document embeddings in fixed-size batches sent concurrently"""
+        batch_size = batch_size or settings.embedding_batch_size
+        max_workers = max_workers or settings.embedding_max_workers
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        if not batches:
+            return []
+        
+        self.logger.info(f"Embedding {len(texts)} texts in {len(batches)} batches with {max_workers} workers")
+        if isinstance(self.embeddings, PooledOpenAIEmbeddings):
+            try:
+                return _io_loop.run(self.embeddings.async_embed_documents(
+                    batches, max_concurrency=max_workers, max_retries=settings.embedding_max_retries
+                ))
+            except Exception as e:
+                self.logger.error(f"Error generating document embeddings: {str(e)}")
+                raise
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+            results = executor.map(self._embed_batch_with_retry, batches)
+            return [vector for batch in results for vector in batch]
+    
+    def _embed_batch_with_retry(self, texts: List[str]) -> List[List[float]]:
+        """Embed one batch, backing off exponentially when rate limited"""
+        for attempt in range(settings.embedding_max_retries + 1):
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if not _is_rate_limit_error(e) or attempt == settings.embedding_max_retries:
+                    self.logger.error(f"Error generating document embeddings: {str(e)}")
+                    raise
+                delay = 2 ** attempt
+                self.logger.warning(f"Embedding batch rate limited, retrying in {delay}s")
+                time.sleep(delay)
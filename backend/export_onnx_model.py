@@ -0,0 +1,61 @@
+"""
+One-time export of a sentence-transformer to ONNX for local embeddings
+
+Usage:
+    python export_onnx_model.py --model sentence-transformers/all-MiniLM-L6-v2 --output models/all-MiniLM-L6-v2
+
+Writes model.onnx (fp32), model_fp16.onnx and model_quantized.onnx (int8) next to
+the tokenizer files. Select one at runtime with EMBEDDING_BACKEND=onnx,
+ONNX_MODEL_PATH=<output> and EMBEDDING_PRECISION=fp32|fp16|int8.
+"""
+import os
+import argparse
+
+from utils import setup_logging
+
+def export_model(model_id: str, output_dir: str) -> None:
+    """Export the model to fp32 ONNX along with its tokenizer"""
+    from optimum.exporters.onnx import main_export
+    
+    main_export(model_id, output=output_dir, task="feature-extraction")
+
+def convert_fp16(output_dir: str) -> None:
+    """Write an fp16 copy of the exported model, keeping fp32 inputs and outputs"""
+    import onnx
+    from onnxruntime.transformers.onnx_model import OnnxModel
+    
+    model = OnnxModel(onnx.load(os.path.join(output_dir, "model.onnx")))
+    model.convert_float_to_float16(keep_io_types=True)
+    model.save_model_to_file(os.path.join(output_dir, "model_fp16.onnx"))
+
+def quantize_int8(output_dir: str, target: str) -> None:
+    """Write a dynamically quantized int8 copy tuned for the target instruction set"""
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    
+    configs = {
+        "avx512_vnni": AutoQuantizationConfig.avx512_vnni,
+        "avx512": AutoQuantizationConfig.avx512,
+        "avx2": AutoQuantizationConfig.avx2,
+        "arm64": AutoQuantizationConfig.arm64
+    }
+    quantizer = ORTQuantizer.from_pretrained(output_dir, file_name="model.onnx")
+    quantizer.quantize(
+        save_dir=output_dir,
+        quantization_config=configs[target](is_static=False, per_channel=False)
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export an embedding model to ONNX")
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--output", default=os.path.join("models", "all-MiniLM-L6-v2"))
+    parser.add_argument("--int8-target", default="avx512_vnni",
+                        choices=["avx512_vnni", "avx512", "avx2", "arm64"])
+    args = parser.parse_args()
+    
+    logger = setup_logging()
+    logger.info(f"Exporting {args.model} to {args.output}")
+    export_model(args.model, args.output)
+    convert_fp16(args.output)
+    quantize_int8(args.output, args.int8_target)
+    logger.info("Export complete")
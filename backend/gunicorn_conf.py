@@ -0,0 +1,25 @@
+import os
+
+# Serve the API on the same port as the development server
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+
+# Threaded workers let many requests wait on the query batcher at once
+worker_class = "gthread"
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+
+# Long timeout so the first index build is not killed mid-way
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '300'))
+
+# Import the app (and load the FAISS index) once in the master process.
+# Forked workers then share the loaded index copy-on-write. The docstore, the
+# embedding matrix and the inverted lists of IVF indexes are memory-mapped and
+# shared through the page cache; Flat and HNSW indexes live in process memory.
+preload_app = True
+
+def post_fork(server, worker):
+    """Mark the process as a worker and give it fresh per-process caches"""
+    os.environ["GUNICORN_WORKER"] = "1"
+    
+    from app import knowledge_base
+    knowledge_base.reset_caches()
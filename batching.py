@@ -0,0 +1,138 @@
+import os
+import time
+import logging
+import threading
+import weakref
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils import settings
+
+# Longest a caller waits for its batch before giving up on the query
+DEFAULT_TIMEOUT_SECONDS = 60.0
+
+# Live schedulers, so a forked child can replace the state its parent's threads left behind
+_schedulers = weakref.WeakSet()
+
+def _reset_schedulers_after_fork():
+    """Give every scheduler fresh locks and queue in a forked child, which has no dispatch thread"""
+    for scheduler in list(_schedulers):
+        scheduler._reset()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_schedulers_after_fork)
+
+def _percentile(sorted_values: List[float], percent: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(percent / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+class BatchingQueryScheduler:
+    """Collects concurrent queries for a short window and resolves them with one batched call"""
+
+    def __init__(self, batch_fn: Callable[[List[str]], List[Any]], max_batch: Optional[int] = None,
+                 max_wait_ms: Optional[float] = None):
+        """
+        Initialize the scheduler
+
+        Args:
+            batch_fn: Function mapping a list of queries to a list of results in the same order
+            max_batch: Largest number of queries dispatched together
+            max_wait_ms: How long the first query in a batch waits for others to join
+        """
+        self.logger = logging.getLogger(__name__)
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch or settings.batch_max_size
+        if max_wait_ms is None:
+            max_wait_ms = settings.batch_max_wait_ms
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._batch_sizes = Counter()
+        self._latencies = deque(maxlen=1000)
+        self._reset()
+        _schedulers.add(self)
+
+    def _reset(self):
+        """Create the locks, queue and worker state for the current process"""
+        self._metrics_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._pending: List[Tuple[str, Future, float]] = []
+        self._thread = None
+
+    def _ensure_worker(self):
+        """Start the dispatch thread on first use in this process"""
+        if self._thread is None:
+            with self._condition:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._worker_loop, name="query-batcher", daemon=True)
+                    self._thread.start()
+
+    def submit(self, query: str) -> Future:
+        """Queue a query and return a future for its result"""
+        self._ensure_worker()
+        future = Future()
+        with self._condition:
+            self._pending.append((query, future, time.monotonic()))
+            self._condition.notify()
+        return future
+
+    def run(self, query: str, timeout: float = DEFAULT_TIMEOUT_SECONDS) -> Any:
+        """Queue a query and block until its batch has been processed, raising TimeoutError after timeout seconds"""
+        return self.submit(query).result(timeout=timeout)
+
+    def _worker_loop(self):
+        """Drain the queue forever, one batch at a time"""
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+
+                # Give concurrent requests until the oldest query's deadline to join
+                deadline = self._pending[0][2] + self.max_wait
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: List[Tuple[str, Future, float]]):
+        """Run the batch function once and fan the results back out"""
+        try:
+            results = self.batch_fn([query for query, _, _ in batch])
+            # A short result list would leave some callers waiting for their timeout
+            if len(results) != len(batch):
+                raise ValueError(f"Batch function returned {len(results)} results for {len(batch)} queries")
+        except Exception as e:
+            self.logger.error(f"Error processing query batch: {str(e)}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+        else:
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+        finished = time.monotonic()
+        with self._metrics_lock:
+            self._batch_sizes[len(batch)] += 1
+            self._latencies.extend(finished - enqueued for _, _, enqueued in batch)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Get the batch-size histogram and latency percentiles of recent queries"""
+        with self._metrics_lock:
+            latencies_ms = sorted(latency * 1000.0 for latency in self._latencies)
+            histogram = dict(sorted(self._batch_sizes.items()))
+        return {
+            "batches": sum(histogram.values()),
+            "batch_size_histogram": {str(size): count for size, count in histogram.items()},
+            "latency_ms": {
+                "samples": len(latencies_ms),
+                "p50": _percentile(latencies_ms, 50),
+                "p99": _percentile(latencies_ms, 99)
+            }
+        }
@@ -0,0 +1,85 @@
+import logging
+from typing import Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Numba is optional; without it retrieval falls back to vectorized NumPy
+try:
+    import numba
+except ImportError:
+    numba = None
+
+def _top_k_rows_numpy(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """NumPy version of _top_k_rows"""
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-top, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _top_k_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Select the k largest entries of each row without sorting the whole row
+
+        Args:
+            scores: Score matrix of shape (Q, N)
+            k: Number of entries to keep per row, at most N
+
+        Returns:
+            Column indices and scores of shape (Q, k), best first
+        """
+        num_rows, n = scores.shape
+        idx = np.empty((num_rows, k), dtype=np.int64)
+        top = np.empty((num_rows, k), dtype=scores.dtype)
+        for row in range(num_rows):
+            # Keep the best k seen so far in descending order, inserting each better score in place
+            count = 0
+            for i in range(n):
+                score = scores[row, i]
+                if count == k and score <= top[row, k - 1]:
+                    continue
+                pos = count if count < k else k - 1
+                while pos > 0 and top[row, pos - 1] < score:
+                    top[row, pos] = top[row, pos - 1]
+                    idx[row, pos] = idx[row, pos - 1]
+                    pos -= 1
+                top[row, pos] = score
+                idx[row, pos] = i
+                if count < k:
+                    count += 1
+        return idx, top
+else:
+    _top_k_rows = _top_k_rows_numpy
+
+def top_k_cosine(xq: np.ndarray, xb: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact top-k search by inner product over a matrix of unit-normalized rows
+
+    Args:
+        xq: Normalized query vectors of shape (Q, d)
+        xb: Normalized embedding matrix of shape (N, d)
+        k: Number of results to return per query
+
+    Returns:
+        Row indices and cosine scores of shape (Q, min(k, N)), best first
+    """
+    if xq.ndim != 2 or xb.ndim != 2 or xq.shape[1] != xb.shape[1]:
+        raise ValueError(f"Query shape {xq.shape} does not match embedding matrix shape {xb.shape}")
+    k = min(k, xb.shape[0])
+    if k <= 0:
+        return np.empty((len(xq), 0), dtype=np.int64), np.empty((len(xq), 0), dtype=np.float32)
+
+    # One matrix product scores every query against every row
+    scores = xq @ xb.T
+    return _top_k_rows(scores, k)
+
+def warm_up() -> None:
+    """Compile the selection kernel up front so the first query does not pay for it"""
+    if numba is None:
+        return
+    logger.info("Compiling fast retrieval kernel")
+    xb = np.zeros((2, 4), dtype=np.float32)
+    top_k_cosine(xb, xb, 1)
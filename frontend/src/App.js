@@ -101,12 +101,40 @@ function App() {
     setSources([]);
     
     try {
-      const response = await axios.post(`${API_URL}/query`, { query });
-      if (response.data.status === 'success') {
-        setAnswer(response.data.answer);
-        setSources(response.data.sources || []);
-      } else {
-        showSnackbar(response.data.message || 'Error getting answer', 'error');
+      // Stream the answer so tokens are shown as soon as they are generated
+      const response = await fetch(`${API_URL}/query`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ query, stream: true })
+      });
+      if (!response.ok || !response.body) {
+        throw new Error(`Request failed with status ${response.status}`);
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Server-sent events are separated by a blank line
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const rawEvent of events) {
+          const event = parseServerSentEvent(rawEvent);
+          if (event.name === 'sources') {
+            setSources(event.data || []);
+            setLoading(false);
+          } else if (event.name === 'token') {
+            setAnswer(prev => prev + event.data);
+          } else if (event.name === 'done') {
+            setAnswer(event.data.answer);
+          } else if (event.name === 'error') {
+            showSnackbar(event.data.message || 'Error getting answer', 'error');
+          }
+        }
       }
     } catch (err) {
       console.error('Error submitting query:', err);
@@ -116,6 +144,20 @@ function App() {
     }
   };
 
+  // Parse one server-sent event into its name and JSON payload
+  const parseServerSentEvent = (rawEvent) => {
+    let name = 'message';
+    let data = '';
+    rawEvent.split('\n').forEach(line => {
+      if (line.startsWith('event: ')) {
+        name = line.slice(7);
+      } else if (line.startsWith('data: ')) {
+        data += line.slice(6);
+      }
+    });
+    return { name, data: data ? JSON.parse(data) : null };
+  };
+
   // Show snackbar message
   const showSnackbar = (message, severity = 'info') => {
     setSnackbarMessage(message);
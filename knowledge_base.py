@@ -1,19 +1,100 @@
 import os
-import glob
 import logging
-import pickle
-from typing import List, Tuple, Dict, Optional
+import multiprocessing
+import queue
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import repeat
+from typing import Any, Iterator, List, Tuple, Dict, Optional
+
+import faiss
+import numpy as np
+import tiktoken
 
 # LangChain imports
+from langchain.callbacks.base import BaseCallbackHandler
 from langchain.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import OpenAIEmbeddings
 from langchain.vectorstores import FAISS
-from langchain.chains import RetrievalQA
+from langchain.chains.question_answering import load_qa_chain
 from langchain.chat_models import ChatOpenAI
+from langchain.prompts import PromptTemplate
+from langchain.schema import Document
 
 # Import custom modules
-from utils import get_env_variable
+import fast_ops
+from batching import BatchingQueryScheduler
+from embeddings import ONNX_MAX_LENGTH, EmbeddingManager, QueryCache, query_cache_key
+from utils import settings
+from vector_index import (
+    ArrowDocstore,
+    PositionalIdMapping,
+    build_index,
+    index_factory_string,
+    measure_recall,
+    set_search_params
+)
+
+# Tokenizer used to measure chunk sizes, matching the OpenAI models
+TOKEN_ENCODING = "cl100k_base"
+
+# Prompt with specific instructions for Transfer Pricing
+QA_PROMPT_TEMPLATE = """You are a Transfer Pricing knowledge agent for UAE tax regulations. 
+Use the following pieces of context to answer the question at the end.
+If you don't know the answer, just say that you don't know, don't try to make up an answer.
+Always cite the section or page number from the Transfer Pricing guide if possible.
+
+Context:
+{context}
+
+Question: {question}
+
+Answer:"""
+
+# Number of characters of each source document returned with an answer
+SOURCE_PREVIEW_LENGTH = 200
+
+# Chunk metadata used only for indexing, left out of the sources returned to clients
+INTERNAL_METADATA_KEYS = ("chunk_id", "token_count", "content_length")
+
+def _load_and_split(pdf_path: str, chunk_tokens: int, chunk_overlap_tokens: int) -> List[Dict]:
+    """Load one PDF and split it into token-sized chunks, returned as plain dicts so they pickle cheaply"""
+    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name=TOKEN_ENCODING,
+        chunk_size=chunk_tokens,
+        chunk_overlap=chunk_overlap_tokens,
+        separators=["\n\n", "\n", ".", " ", ""]
+    )
+    chunks = text_splitter.split_documents(PyPDFLoader(pdf_path).load())
+    
+    # The splitter only measures the pieces it merges, so each finished chunk is encoded
+    # once more here, in one native batch call, purely to record its exact token count
+    encoded = tiktoken.get_encoding(TOKEN_ENCODING).encode_batch([c.page_content for c in chunks])
+    return [
+        {
+            "page_content": c.page_content,
+            "metadata": {**c.metadata, "token_count": len(tokens), "content_length": len(c.page_content)}
+        }
+        for c, tokens in zip(chunks, encoded)
+    ]
+
+class _TokenQueueHandler(BaseCallbackHandler):
+    """Forwards streamed LLM tokens to a queue read by the response generator"""
+    
+    def __init__(self, tokens: queue.Queue):
+        self.tokens = tokens
+    
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.tokens.put(token)
+
+@dataclass(frozen=True)
+class _IndexState:
+    """Everything a search reads, published together so a reload never mixes generations"""
+    vector_store: FAISS
+    embedding_matrix: Optional[np.ndarray]
 
 class KnowledgeBase:
     """Class to manage the knowledge base for the Transfer Pricing agent"""
@@ -24,41 +105,96 @@ class KnowledgeBase:
         self.documents_path = os.path.join('data', 'documents')
         self.vector_db_path = os.path.join('vector_db', 'faiss_index')
         
-        # Settings from environment variables
-        self.model_name = get_env_variable('MODEL_NAME', 'gpt-3.5-turbo')
-        self.embedding_model = get_env_variable('EMBEDDING_MODEL', 'text-embedding-ada-002')
-        self.chunk_size = int(get_env_variable('CHUNK_SIZE', '1000'))
-        self.chunk_overlap = int(get_env_variable('CHUNK_OVERLAP', '100'))
+        # Parse the prompt once; every chain built later reuses it
+        self._prompt = PromptTemplate(template=QA_PROMPT_TEMPLATE, input_variables=["context", "question"])
         
         # Initialize components to None
-        self.vector_store = None
+        self._state = None
         self.qa_chain = None
         self.embeddings = None
+        
+        # ({directory: mtime}, document list) from the last scan of documents_path
+        self._docs_cache = (None, [])
+        
+        # Identity of the saved index.faiss that is loaded, so other processes' rebuilds are noticed
+        self._index_generation = None
+        self._reload_lock = threading.Lock()
+        
+        # Embeddings are shared so query vectors are cached across requests
+        self.embeddings_mgr = EmbeddingManager()
+        self.answer_cache = QueryCache()
+        
+        # Concurrent queries share one embedding call and one index search
+        self.scheduler = BatchingQueryScheduler(self._retrieve_batch)
+
+    @property
+    def vector_store(self) -> Optional[FAISS]:
+        """Vector store wrapping the loaded index, docstore and id mapping"""
+        return self._state.vector_store if self._state else None
+
+    @property
+    def embedding_matrix(self) -> Optional[np.ndarray]:
+        """Memory-mapped (N, d) matrix used for exact fast retrieval"""
+        return self._state.embedding_matrix if self._state else None
 
     def initialize(self, force_refresh: bool = False) -> str:
         """Initialize or refresh the knowledge base"""
+        # Cached answers refer to the previous index
+        self.answer_cache.clear()
+        
+        if settings.fast_retrieval_max > 0:
+            fast_ops.warm_up()
+        
         # Check if vector database already exists
-        if os.path.exists(f"{self.vector_db_path}.pkl") and not force_refresh:
+        if self._vector_db_exists() and not force_refresh:
             self.logger.info("Loading existing vector database")
             return self._load_existing_vector_db()
         else:
             self.logger.info("Creating new vector database")
             return self._create_vector_db()
 
+    def _vector_db_exists(self) -> bool:
+        """Check whether a saved index and docstore are available"""
+        return all(
+            os.path.exists(os.path.join(self.vector_db_path, name))
+            for name in ("index.faiss", "docstore.arrow")
+        )
+
     def _load_existing_vector_db(self) -> str:
         """Load an existing vector database"""
         try:
             # Initialize the embeddings
-            self.embeddings = OpenAIEmbeddings(model=self.embedding_model)
+            self.embeddings = self.embeddings_mgr
             
-            # Load the vector store
-            self.vector_store = FAISS.load_local(
-                self.vector_db_path, 
-                self.embeddings
+            # Taken before reading, so a rebuild saved meanwhile still triggers a reload
+            generation = self._saved_index_generation()
+            
+            # IO_FLAG_MMAP only maps the inverted lists of IVF indexes, which then page in on demand;
+            # Flat and HNSW indexes are still read fully into memory
+            index = faiss.read_index(
+                os.path.join(self.vector_db_path, "index.faiss"),
+                faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
             )
             
+            # Open the columnar docstore zero-copy from its memory-mapped file
+            docstore = ArrowDocstore.load(os.path.join(self.vector_db_path, "docstore.arrow"))
+            vector_store = FAISS(
+                self.embeddings_mgr.embed_query,
+                index,
+                docstore,
+                PositionalIdMapping(len(docstore)),
+                normalize_L2=True
+            )
+            set_search_params(index, settings.nprobe)
+            
+            # Map the embedding matrix without reading it into memory
+            matrix_path = os.path.join(self.vector_db_path, "embeddings.npy")
+            matrix = np.load(matrix_path, mmap_mode='r') if os.path.exists(matrix_path) else None
+            self._state = _IndexState(vector_store, matrix)
+            
             # Create the QA chain
             self._create_qa_chain()
+            self._index_generation = generation
             
             return "Successfully loaded existing knowledge base"
         except Exception as e:
@@ -69,36 +205,67 @@ class KnowledgeBase:
     def _create_vector_db(self) -> str:
         """Create a new vector database from documents"""
         try:
-            # Get all document paths
-            pdf_files = glob.glob(os.path.join(self.documents_path, "**", "*.pdf"), recursive=True)
+            # Get all document paths, largest first so the biggest PDF starts parsing first
+            pdf_files = sorted(self._iter_pdfs(), key=os.path.getsize, reverse=True)
             
             if not pdf_files:
                 raise ValueError(f"No PDF files found in {self.documents_path}")
             
             # Initialize the embeddings
-            self.embeddings = OpenAIEmbeddings(model=self.embedding_model)
+            self.embeddings = self.embeddings_mgr
+            self._check_chunk_settings()
             
-            # Load and process all documents
-            documents = []
-            for pdf_file in pdf_files:
-                self.logger.info(f"Processing document: {pdf_file}")
-                loader = PyPDFLoader(pdf_file)
-                documents.extend(loader.load())
-            
-            # Split documents into chunks
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=self.chunk_size,
-                chunk_overlap=self.chunk_overlap,
-                separators=["\n\n", "\n", ".", " ", ""]
+            # Load and split the documents in parallel, one PDF per worker process. Workers are
+            # spawned, not forked: a fork from a threaded server could inherit locks held by
+            # the batching or embedding threads and deadlock
+            self.logger.info(f"Processing {len(pdf_files)} documents")
+            texts = []
+            with ProcessPoolExecutor(
+                max_workers=min(len(pdf_files), os.cpu_count() or 1),
+                mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                chunk_lists = executor.map(
+                    _load_and_split, pdf_files, repeat(settings.chunk_tokens), repeat(settings.chunk_overlap_tokens)
+                )
+                for chunks in chunk_lists:
+                    texts.extend(Document(**chunk) for chunk in chunks)
+            
+            # Embed all chunks in concurrent batches into one contiguous (N, d) matrix,
+            # unit-normalized so L2 search ranks by cosine similarity
+            page_contents = [t.page_content for t in texts]
+            vectors = np.asarray(
+                self.embeddings_mgr.embed_documents_batched(page_contents),
+                dtype=np.float32
             )
-            texts = text_splitter.split_documents(documents)
+            faiss.normalize_L2(vectors)
             
-            # Create the vector store
-            self.vector_store = FAISS.from_documents(texts, self.embeddings)
+            # Build an index sized for the corpus and wrap it in the vector store
+            factory_string = index_factory_string(
+                vectors.shape[1], len(vectors), settings.index_type,
+                nlist=settings.ivf_nlist, pq_m=settings.pq_m, precision=settings.vector_precision
+            )
+            index = build_index(vectors, factory_string, train_sample_size=settings.train_sample_size)
+            set_search_params(index, settings.nprobe)
+            if factory_string != "Flat":
+                recall = measure_recall(index, vectors, k=settings.retrieval_k)
+                self.logger.info(f"{factory_string} recall@{settings.retrieval_k} vs exact search: {recall:.3f}")
+            docstore = ArrowDocstore.from_documents(texts)
+            vector_store = FAISS(
+                self.embeddings_mgr.embed_query,
+                index,
+                docstore,
+                PositionalIdMapping(len(docstore)),
+                normalize_L2=True
+            )
             
-            # Save the vector store
-            os.makedirs(os.path.dirname(self.vector_db_path), exist_ok=True)
-            self.vector_store.save_local(self.vector_db_path)
+            # Save the index, docstore and raw matrix; the latter two are memory-mapped when loaded
+            self._save_vector_db(index, docstore, vectors)
+            
+            # Map the saved matrix rather than keeping the fp32 build copy on the heap,
+            # where a preloading master would hand it to every forked worker
+            matrix = np.load(os.path.join(self.vector_db_path, "embeddings.npy"), mmap_mode='r')
+            self._state = _IndexState(vector_store, matrix)
+            self._index_generation = self._saved_index_generation()
             
             # Create the QA chain
             self._create_qa_chain()
@@ -108,60 +275,260 @@ class KnowledgeBase:
             self.logger.error(f"Error creating vector database: {str(e)}")
             raise
 
+    def _check_chunk_settings(self):
+        """Warn about chunking configuration that silently produces oversized chunks"""
+        for old_name in ("CHUNK_SIZE", "CHUNK_OVERLAP"):
+            if old_name in os.environ:
+                self.logger.warning(
+                    f"{old_name} was measured in characters and is no longer read; "
+                    "set CHUNK_TOKENS and CHUNK_OVERLAP_TOKENS in tokens instead"
+                )
+        if settings.embedding_backend == 'onnx' and settings.chunk_tokens > ONNX_MAX_LENGTH:
+            self.logger.warning(
+                f"CHUNK_TOKENS={settings.chunk_tokens} exceeds the local embedding model's "
+                f"{ONNX_MAX_LENGTH}-token window; the end of each chunk will not be embedded"
+            )
+
+    def _save_vector_db(self, index: faiss.Index, docstore: ArrowDocstore, vectors: np.ndarray):
+        """Write the vector database to a staging directory and swap each file into place"""
+        os.makedirs(self.vector_db_path, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.vector_db_path)
+        try:
+            np.save(os.path.join(staging, "embeddings.npy"), vectors)
+            docstore.save(os.path.join(staging, "docstore.arrow"))
+            faiss.write_index(index, os.path.join(staging, "index.faiss"))
+            
+            # os.replace links in new inodes, so processes still mapping the old files are unaffected.
+            # index.faiss goes last because replacing it is what marks a new generation.
+            for name in ("embeddings.npy", "docstore.arrow", "index.faiss"):
+                os.replace(os.path.join(staging, name), os.path.join(self.vector_db_path, name))
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _saved_index_generation(self) -> Optional[Tuple[int, int]]:
+        """Get the inode and mtime of the saved index.faiss, or None if there is none"""
+        try:
+            stat = os.stat(os.path.join(self.vector_db_path, "index.faiss"))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _reload_if_stale(self):
+        """Reload the vector database when another process has saved a newer one"""
+        generation = self._saved_index_generation()
+        if generation is None or generation == self._index_generation:
+            return
+        with self._reload_lock:
+            if self._saved_index_generation() != self._index_generation:
+                self.logger.info("Saved vector database changed; reloading")
+                # Cached answers refer to the previous index
+                self.answer_cache.clear()
+                self._load_existing_vector_db()
+
     def _create_qa_chain(self):
-        """Create the QA chain with the LLM and retriever"""
-        llm = ChatOpenAI(model_name=self.model_name, temperature=0)
-        
-        # Create a prompt template that includes specific instructions for Transfer Pricing
-        template = """You are a Transfer Pricing knowledge agent for UAE tax regulations. 
-        Use the following pieces of context to answer the question at the end.
-        If you don't know the answer, just say that you don't know, don't try to make up an answer.
-        Always cite the section or page number from the Transfer Pricing guide if possible.
-        
-        Context:
-        {context}
-        
-        Question: {question}
-        
-        Answer:"""
-        
-        # Create the QA chain
-        self.qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 5}
-            ),
-            chain_type_kwargs={
-                "prompt": template
-            },
-            return_source_documents=True
-        )
+        """Create the QA chain that answers from already retrieved documents"""
+        # Streaming lets ask_stream forward tokens; blocking calls still get the full answer
+        llm = ChatOpenAI(model_name=settings.model_name, temperature=0, streaming=True)
+        
+        # Retrieval happens in the batching scheduler, so only the "stuff" step is needed
+        self.qa_chain = load_qa_chain(llm, chain_type="stuff", prompt=self._prompt)
 
     def ask(self, query: str) -> Tuple[str, List[Dict]]:
         """Ask a question and get an answer with sources"""
         if not self.qa_chain:
             raise ValueError("Knowledge base not initialized. Call initialize() first.")
         
-        # Get the answer
-        result = self.qa_chain({"query": query})
+        # Pick up an index rebuilt by another worker before answering from this one
+        self._reload_if_stale()
+        
+        # Serve repeated questions without retrieval or an LLM call
+        cache_key = query_cache_key(query)
+        cached = self.answer_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Retrieve context alongside any concurrent queries, then generate the answer
+        source_documents = self.scheduler.run(query)
+        answer = self.qa_chain.run(
+            input_documents=source_documents,
+            question=query
+        )
+        
+        sources = self._format_sources(source_documents)
+        self.answer_cache.put(cache_key, (answer, sources))
+        return answer, sources
+
+    def ask_stream(self, query: str) -> Iterator[Tuple[str, Any]]:
+        """
+        Ask a question and stream the result as (event, data) pairs
+        
+        Yields a "sources" event as soon as retrieval finishes, a "token" event for
+        each piece of the answer as the LLM generates it, and a final "done" event
+        carrying the complete answer.
+        """
+        if not self.qa_chain:
+            raise ValueError("Knowledge base not initialized. Call initialize() first.")
+        
+        # Pick up an index rebuilt by another worker before answering from this one
+        self._reload_if_stale()
+        
+        cache_key = query_cache_key(query)
+        cached = self.answer_cache.get(cache_key)
+        if cached is not None:
+            answer, sources = cached
+            yield "sources", sources
+            yield "token", answer
+            yield "done", {"answer": answer}
+            return
+        
+        source_documents = self.scheduler.run(query)
+        sources = self._format_sources(source_documents)
+        yield "sources", sources
+        
+        # Generate in a background thread, bridging tokens through a queue
+        tokens = queue.Queue()
+        result = {}
         
-        # Extract the answer
-        answer = result.get("result", "")
+        def generate():
+            try:
+                result["answer"] = self.qa_chain.run(
+                    input_documents=source_documents,
+                    question=query,
+                    callbacks=[_TokenQueueHandler(tokens)]
+                )
+            except Exception as e:
+                result["error"] = e
+            finally:
+                tokens.put(None)
         
-        # Extract source metadata
+        threading.Thread(target=generate, daemon=True).start()
+        while True:
+            token = tokens.get()
+            if token is None:
+                break
+            yield "token", token
+        
+        if "error" in result:
+            raise result["error"]
+        self.answer_cache.put(cache_key, (result["answer"], sources))
+        yield "done", {"answer": result["answer"]}
+
+    @staticmethod
+    def _format_sources(source_documents: List[Document]) -> List[Dict]:
+        """Extract source previews and metadata, using the length recorded at index build time"""
         sources = []
-        source_documents = result.get("source_documents", [])
-        for i, doc in enumerate(source_documents):
+        for doc in source_documents:
+            content = doc.page_content
+            length = doc.metadata.get("content_length") or len(content)
+            if length > SOURCE_PREVIEW_LENGTH:
+                content = content[:SOURCE_PREVIEW_LENGTH] + "..."
             sources.append({
-                "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                "metadata": doc.metadata
+                "content": content,
+                "metadata": {k: v for k, v in doc.metadata.items() if k not in INTERNAL_METADATA_KEYS}
             })
+        return sources
+
+    def _retrieve_batch(self, queries: List[str]) -> List[List[Document]]:
+        """Embed a batch of queries and search the index for all of them in one call"""
+        # One snapshot, so a concurrent reload cannot pair old row numbers with a new docstore
+        state = self._state
+        vector_store = state.vector_store
+        query_vectors = np.asarray(self.embeddings_mgr.embed_queries(queries), dtype=np.float32)
+        faiss.normalize_L2(query_vectors)
         
-        return answer, sources
+        # Corpora under FAST_RETRIEVAL_MAX are searched exactly in-process, bypassing the FAISS index
+        matrix = state.embedding_matrix
+        if matrix is not None and len(matrix) <= settings.fast_retrieval_max:
+            indices, _ = fast_ops.top_k_cosine(query_vectors, matrix, settings.retrieval_k)
+        else:
+            _, indices = vector_store.index.search(query_vectors, settings.retrieval_k)
+        results = []
+        for row in indices:
+            documents = []
+            for i in row:
+                if i == -1:
+                    continue
+                doc = vector_store.docstore.search(vector_store.index_to_docstore_id.get(int(i), str(i)))
+                # The docstore answers unknown ids with a message string rather than raising
+                if not isinstance(doc, Document):
+                    self.logger.warning(f"Skipping search result {i}: {doc}")
+                    continue
+                documents.append(doc)
+            results.append(documents)
+        return results
+
+    def reset_caches(self):
+        """Replace the query caches, e.g. in a freshly forked worker process"""
+        self.answer_cache = QueryCache()
+        self.embeddings_mgr.query_cache = QueryCache()
+
+    def batching_metrics(self) -> Dict:
+        """Get batch-size and latency statistics for query retrieval"""
+        return self.scheduler.metrics()
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Get hit/miss statistics for the answer and query embedding caches"""
+        return {
+            "answers": self.answer_cache.stats(),
+            "query_embeddings": self.embeddings_mgr.query_cache.stats()
+        }
+
+    def _iter_pdfs(self, dir_mtimes: Optional[Dict[str, Optional[int]]] = None) -> Iterator[str]:
+        """
+        Yield the paths of all PDFs under documents_path, walking it with os.scandir
+        
+        Args:
+            dir_mtimes: If given, filled with the mtime of every directory visited (None if missing)
+        """
+        stack = [self.documents_path]
+        while stack:
+            path = stack.pop()
+            # Taken before listing, so a change during the walk still invalidates the result
+            if dir_mtimes is not None:
+                try:
+                    dir_mtimes[path] = os.stat(path).st_mtime_ns
+                except OSError:
+                    dir_mtimes[path] = None
+            try:
+                entries = os.scandir(path)
+            except OSError as e:
+                # Unreadable directories are skipped, as glob did
+                if not isinstance(e, FileNotFoundError):
+                    self.logger.warning(f"Skipping unreadable directory {path}: {str(e)}")
+                continue
+            with entries:
+                for entry in entries:
+                    # Hidden entries are skipped, as glob did
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        # Symlinked directories are not followed, so link cycles cannot loop the walk
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file() and entry.name.endswith('.pdf'):
+                            yield entry.path
+                    except OSError as e:
+                        self.logger.warning(f"Skipping unreadable entry {entry.path}: {str(e)}")
+
+    @staticmethod
+    def _dirs_unchanged(dir_mtimes: Dict[str, Optional[int]]) -> bool:
+        """Check whether every directory recorded by _iter_pdfs still has the same mtime"""
+        for path, mtime in dir_mtimes.items():
+            try:
+                current = os.stat(path).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime:
+                return False
+        return True
 
     def get_documents(self) -> List[str]:
         """Get a list of all documents in the knowledge base"""
-        pdf_files = glob.glob(os.path.join(self.documents_path, "**", "*.pdf"), recursive=True)
-        return [os.path.relpath(pdf, self.documents_path) for pdf in pdf_files]
\ No newline at end of file
+        # Only rescan when a directory in the tree has changed; adding a file
+        # to a subdirectory updates that subdirectory's mtime, not its parent's
+        dir_mtimes, documents = self._docs_cache
+        if dir_mtimes is None or not self._dirs_unchanged(dir_mtimes):
+            dir_mtimes = {}
+            documents = [os.path.relpath(pdf, self.documents_path) for pdf in self._iter_pdfs(dir_mtimes)]
+            self._docs_cache = (dir_mtimes, documents)
+        return list(documents)
\ No newline at end of file
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The backend modules are imported by bare name, as app.py does
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "backend")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+from batching import BatchingQueryScheduler
+
+def test_concurrent_submits_share_one_batch():
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def batch_fn(queries):
+        calls.append(list(queries))
+        started.set()
+        release.wait(5)
+        return [query.upper() for query in queries]
+
+    scheduler = BatchingQueryScheduler(batch_fn, max_batch=8, max_wait_ms=0)
+
+    # Hold the worker in the first batch while more queries queue up behind it
+    first = scheduler.submit("a")
+    assert started.wait(5)
+    futures = [scheduler.submit(query) for query in "bcd"]
+    release.set()
+
+    assert first.result(5) == "A"
+    assert [future.result(5) for future in futures] == ["B", "C", "D"]
+    assert calls == [["a"], ["b", "c", "d"]]
+
+    metrics = scheduler.metrics()
+    assert metrics["batches"] == 2
+    assert metrics["batch_size_histogram"] == {"1": 1, "3": 1}
+    assert metrics["latency_ms"]["samples"] == 4
+    assert metrics["latency_ms"]["p50"] <= metrics["latency_ms"]["p99"]
+
+def test_max_batch_splits_queue():
+    calls = []
+    scheduler = BatchingQueryScheduler(lambda queries: calls.append(len(queries)) or list(queries),
+                                       max_batch=2, max_wait_ms=50)
+
+    futures = [scheduler.submit(str(i)) for i in range(5)]
+
+    assert [future.result(5) for future in futures] == ["0", "1", "2", "3", "4"]
+    assert max(calls) <= 2 and sum(calls) == 5
+
+def test_exception_reaches_every_caller():
+    def batch_fn(queries):
+        raise RuntimeError("index unavailable")
+
+    scheduler = BatchingQueryScheduler(batch_fn, max_wait_ms=50)
+    futures = [scheduler.submit(query) for query in "abc"]
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match="index unavailable"):
+            future.result(5)
+
+def test_short_result_list_fails_the_batch():
+    scheduler = BatchingQueryScheduler(lambda queries: list(queries)[1:], max_wait_ms=50)
+    futures = [scheduler.submit(query) for query in "ab"]
+
+    for future in futures:
+        with pytest.raises(ValueError, match="results for"):
+            future.result(5)
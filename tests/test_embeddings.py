@@ -0,0 +1,142 @@
+import asyncio
+import dataclasses
+import types
+
+import httpx
+import openai
+import orjson
+import pytest
+
+import embeddings
+from embeddings import EmbeddingManager, PooledOpenAIEmbeddings, QueryCache, _io_loop, query_cache_key
+
+@pytest.fixture
+def requests(monkeypatch):
+    """Serve the embeddings API from a mock transport and record each request"""
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = orjson.loads(request.content)
+        seen.append((request, body["input"]))
+        if "rate-limited" in body["input"]:
+            return httpx.Response(429, json={"error": {"message": "Rate limit reached", "type": "requests"}})
+        data = [{"object": "embedding", "index": i, "embedding": [float(len(text)), 1.0]}
+                for i, text in enumerate(body["input"])]
+        return httpx.Response(200, json={
+            "object": "list", "data": data, "model": body["model"],
+            "usage": {"prompt_tokens": 1, "total_tokens": 1}
+        })
+
+    _io_loop._ensure_started()
+    monkeypatch.setattr(_io_loop, "_http_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return seen
+
+def test_embed_documents_batches_by_chunk_size(requests):
+    model = PooledOpenAIEmbeddings(openai_api_key="test-key", openai_api_base="http://embeddings.test/v1")
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+
+    vectors = model.embed_documents(texts, chunk_size=2)
+
+    assert vectors == [[float(len(text)), 1.0] for text in texts]
+    assert sorted(len(batch) for _, batch in requests) == [1, 2, 2]
+
+    # The model's key and base URL are used rather than the SDK defaults
+    request = requests[0][0]
+    assert str(request.url) == "http://embeddings.test/v1/embeddings"
+    assert request.headers["authorization"] == "Bearer test-key"
+
+def test_pooled_client_is_reused(requests):
+    model = PooledOpenAIEmbeddings(openai_api_key="test-key")
+
+    model.embed_query("first")
+    client = model._client
+    model.embed_query("second")
+
+    assert model._client is client
+    assert len(requests) == 2
+
+def test_rate_limit_retries_come_from_settings(requests, monkeypatch):
+    monkeypatch.setattr(embeddings, "settings", dataclasses.replace(embeddings.settings, embedding_max_retries=2))
+    sleeps = []
+
+    async def no_sleep(seconds):
+        sleeps.append(seconds)
+    monkeypatch.setattr(asyncio, "sleep", no_sleep)
+
+    # SDK retries disabled, so every request seen is one of our own attempts
+    model = PooledOpenAIEmbeddings(openai_api_key="test-key", max_retries=0)
+    with pytest.raises(openai.RateLimitError):
+        model.embed_query("rate-limited")
+
+    assert len(requests) == 3
+    assert sleeps == [1, 2]
+
+def test_query_cache_evicts_least_recently_used():
+    cache = QueryCache(max_size=2, ttl_seconds=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+
+    # "b" is now the least recently used entry
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["size"] == 2
+
+def test_query_cache_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(embeddings, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    cache = QueryCache(max_size=4, ttl_seconds=10)
+    cache.put("a", 1)
+
+    now[0] += 10
+    assert cache.get("a") == 1
+    now[0] += 0.5
+    assert cache.get("a") is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 0)
+
+def test_query_cache_with_zero_size_stores_nothing():
+    cache = QueryCache(max_size=0, ttl_seconds=60)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+def test_query_cache_keys_ignore_case_and_whitespace():
+    assert query_cache_key("What is  TP?") == query_cache_key(" what is tp? ")
+    assert query_cache_key("What is TP?") != query_cache_key("What is BEPS?")
+
+class CountingEmbeddings(embeddings.Embeddings):
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def test_embed_query_skips_backend_on_cache_hit():
+    manager = EmbeddingManager()
+    backend = manager._embeddings = CountingEmbeddings()
+
+    first = manager.embed_query("Arm's length principle")
+    second = manager.embed_query("arm's  length principle")
+
+    assert first == second
+    assert len(backend.calls) == 1
+
+def test_embed_queries_only_embeds_misses_once():
+    manager = EmbeddingManager()
+    backend = manager._embeddings = CountingEmbeddings()
+    manager.embed_query("cached")
+
+    vectors = manager.embed_queries(["new", "cached", "NEW"])
+
+    assert vectors == [[3.0], [6.0], [3.0]]
+    # "new" and "NEW" share a cache key, so one backend call embeds a single text
+    assert backend.calls[0] == ["cached"]
+    assert len(backend.calls) == 2 and len(backend.calls[1]) == 1
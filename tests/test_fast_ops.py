@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+import fast_ops
+
+def _unit_rows(rng, n, d):
+    x = rng.standard_normal((n, d)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+@pytest.mark.parametrize("select", [fast_ops._top_k_rows, fast_ops._top_k_rows_numpy])
+def test_top_k_rows_matches_full_sort(select):
+    scores = np.random.default_rng(0).standard_normal((7, 300)).astype(np.float32)
+
+    idx, top = select(scores, 5)
+
+    expected = np.argsort(-scores, axis=1)[:, :5]
+    np.testing.assert_array_equal(idx, expected)
+    np.testing.assert_array_equal(top, np.take_along_axis(scores, expected, axis=1))
+
+def test_top_k_cosine_batches_queries():
+    rng = np.random.default_rng(1)
+    xb = _unit_rows(rng, 50, 16)
+    # Memory-mapped matrices arrive read-only
+    xb.setflags(write=False)
+
+    idx, scores = fast_ops.top_k_cosine(xb[[3, 17]], xb, 3)
+
+    assert idx.shape == scores.shape == (2, 3)
+    assert list(idx[:, 0]) == [3, 17]
+    np.testing.assert_allclose(scores[:, 0], 1.0, rtol=1e-5)
+
+def test_top_k_cosine_caps_k_at_matrix_size():
+    xb = _unit_rows(np.random.default_rng(2), 2, 8)
+    idx, _ = fast_ops.top_k_cosine(xb, xb, 5)
+    assert idx.shape == (2, 2)
+
+def test_top_k_cosine_rejects_mismatched_dimensions():
+    rng = np.random.default_rng(3)
+    with pytest.raises(ValueError):
+        fast_ops.top_k_cosine(_unit_rows(rng, 1, 8), _unit_rows(rng, 10, 16), 3)
@@ -0,0 +1,199 @@
+import dataclasses
+import hashlib
+import os
+from typing import Dict, List
+
+import numpy as np
+import pytest
+from langchain.embeddings.base import Embeddings
+from langchain.llms.fake import FakeListLLM
+
+import knowledge_base
+from knowledge_base import KnowledgeBase
+
+DIM = 64
+
+# Chunk text written into each fake PDF, one chunk per line
+PDF_CHUNKS = {
+    "arm_length.pdf": [
+        "The arm's length principle requires related party prices to match independent parties.",
+        "Comparable uncontrolled price method compares prices in comparable transactions."
+    ],
+    "documentation.pdf": [
+        "A master file and local file must be maintained by qualifying taxpayers.",
+        "Transfer pricing disclosure forms are filed with the corporate tax return."
+    ]
+}
+
+class StubEmbeddings(Embeddings):
+    """Deterministic bag-of-words embeddings that need no network access"""
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(DIM, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % DIM] += 1.0
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+def fake_load_and_split(pdf_path: str, chunk_tokens: int, chunk_overlap_tokens: int) -> List[Dict]:
+    """Stands in for PDF parsing; module-level so spawned pool workers can import it"""
+    with open(pdf_path) as f:
+        lines = f.read().splitlines()
+    return [
+        {
+            "page_content": text,
+            "metadata": {"source": pdf_path, "page": page, "token_count": len(text.split()), "content_length": len(text)}
+        }
+        for page, text in enumerate(lines)
+    ]
+
+@pytest.fixture
+def kb(tmp_path, monkeypatch):
+    documents = tmp_path / "documents"
+    documents.mkdir()
+    for name, chunks in PDF_CHUNKS.items():
+        (documents / name).write_text("\n".join(chunks))
+
+    monkeypatch.setattr(knowledge_base, "_load_and_split", fake_load_and_split)
+    monkeypatch.setattr(knowledge_base, "ChatOpenAI", lambda **kwargs: FakeListLLM(responses=["Stub answer"]))
+    return make_kb(str(documents), str(tmp_path / "vector_db"))
+
+def make_kb(documents_path: str, vector_db_path: str) -> KnowledgeBase:
+    kb = KnowledgeBase()
+    kb.documents_path = documents_path
+    kb.vector_db_path = vector_db_path
+    kb.embeddings_mgr._embeddings = StubEmbeddings()
+    return kb
+
+def test_ask_end_to_end(kb):
+    assert "4 text chunks from 2 documents" in kb.initialize()
+
+    answer, sources = kb.ask("What is the arm's length principle?")
+
+    assert answer == "Stub answer"
+    assert len(sources) == 4
+    assert "arm's length principle" in sources[0]["content"]
+    assert sources[0]["metadata"]["source"].endswith("arm_length.pdf")
+    # Index bookkeeping stays out of the API response
+    assert set(sources[0]["metadata"]) == {"source", "page"}
+
+    # A repeated question is served from the answer cache
+    assert kb.ask("what is the  arm's length principle?") == (answer, sources)
+    assert kb.cache_stats()["answers"]["hits"] == 1
+
+def test_ask_from_saved_index(kb):
+    kb.initialize()
+
+    reloaded = make_kb(kb.documents_path, kb.vector_db_path)
+    assert reloaded.initialize() == "Successfully loaded existing knowledge base"
+
+    _, sources = reloaded.ask("Which files must be maintained?")
+    assert "master file" in sources[0]["content"]
+
+def test_ask_stream_events(kb):
+    kb.initialize()
+
+    events = list(kb.ask_stream("What is the comparable uncontrolled price method?"))
+
+    assert events[0][0] == "sources"
+    assert "Comparable uncontrolled price" in events[0][1][0]["content"]
+    assert events[-1] == ("done", {"answer": "Stub answer"})
+
+def test_vector_store_similarity_search(kb):
+    kb.initialize()
+
+    # The LangChain wrapper embeds the query itself, so it needs a callable
+    docs = kb.vector_store.similarity_search("master file and local file", k=1)
+    assert "master file" in docs[0].page_content
+
+def test_rebuild_is_picked_up_by_other_instances(kb):
+    kb.initialize()
+    other = make_kb(kb.documents_path, kb.vector_db_path)
+    other.initialize()
+    question = "What are the penalties for late filing?"
+    _, before = other.ask(question)
+
+    # Another worker adds a document and rebuilds the shared index
+    with open(f"{kb.documents_path}/penalties.pdf", "w") as f:
+        f.write("Penalties for late filing of transfer pricing reports apply.")
+    kb.initialize(force_refresh=True)
+
+    # No staging files are left next to the swapped-in index
+    assert sorted(os.listdir(kb.vector_db_path)) == ["docstore.arrow", "embeddings.npy", "index.faiss"]
+
+    # The other instance reloads instead of answering from its stale index and answer cache
+    _, after = other.ask(question)
+    assert len(after) == len(before) + 1
+    assert "Penalties for late filing" in after[0]["content"]
+
+def test_fast_retrieval_matches_index_search(kb, monkeypatch):
+    kb.initialize()
+    questions = ["What is the arm's length principle?", "Which files must be maintained?"]
+    expected = kb._retrieve_batch(questions)
+
+    monkeypatch.setattr(knowledge_base, "settings", dataclasses.replace(knowledge_base.settings, fast_retrieval_max=100))
+    assert kb._retrieve_batch(questions) == expected
+
+def test_get_documents_sees_nested_and_top_level_additions(kb):
+    documents = kb.documents_path
+    assert sorted(kb.get_documents()) == ["arm_length.pdf", "documentation.pdf"]
+
+    os.mkdir(os.path.join(documents, "sub"))
+    assert sorted(kb.get_documents()) == ["arm_length.pdf", "documentation.pdf"]
+
+    # A file added inside a subdirectory leaves the top-level mtime unchanged
+    with open(os.path.join(documents, "sub", "nested.pdf"), "wb") as f:
+        f.write(b"%PDF-1.4")
+    assert sorted(kb.get_documents()) == ["arm_length.pdf", "documentation.pdf", os.path.join("sub", "nested.pdf")]
+
+    with open(os.path.join(documents, "top.pdf"), "wb") as f:
+        f.write(b"%PDF-1.4")
+    assert "top.pdf" in kb.get_documents()
+
+def test_get_documents_without_directory(kb):
+    kb.documents_path = os.path.join(kb.vector_db_path, "missing")
+    assert kb.get_documents() == []
+
+    os.makedirs(kb.documents_path)
+    with open(os.path.join(kb.documents_path, "late.pdf"), "wb") as f:
+        f.write(b"%PDF-1.4")
+    assert kb.get_documents() == ["late.pdf"]
+
+def test_built_matrix_is_memory_mapped(kb):
+    kb.initialize()
+    assert isinstance(kb.embedding_matrix, np.memmap)
+
+def test_rows_missing_from_docstore_are_skipped(kb, monkeypatch):
+    kb.initialize()
+    monkeypatch.setattr(knowledge_base, "settings", dataclasses.replace(knowledge_base.settings, fast_retrieval_max=100))
+
+    # A matrix from another generation with rows the docstore does not have
+    matrix = np.vstack([kb.embedding_matrix, kb.embedding_matrix])
+    kb._state = knowledge_base._IndexState(kb.vector_store, matrix)
+
+    [documents] = kb._retrieve_batch(["What is the arm's length principle?"])
+    assert documents and all(isinstance(doc, knowledge_base.Document) for doc in documents)
+    assert len(documents) < knowledge_base.settings.retrieval_k
+
+def test_iter_pdfs_skips_symlink_loops_and_bad_entries(kb):
+    documents = kb.documents_path
+    os.mkdir(os.path.join(documents, "sub"))
+    with open(os.path.join(documents, "sub", "nested.pdf"), "w") as f:
+        f.write("Nested chunk.")
+    # A directory cycle and a self-referencing link that fails with ELOOP
+    os.symlink(documents, os.path.join(documents, "sub", "cycle"))
+    os.symlink("broken.pdf", os.path.join(documents, "broken.pdf"))
+
+    found = sorted(os.path.relpath(path, documents) for path in kb._iter_pdfs())
+
+    assert found == ["arm_length.pdf", "documentation.pdf", os.path.join("sub", "nested.pdf")]
+
+def test_legacy_chunk_size_is_reported(kb, monkeypatch, caplog):
+    monkeypatch.setenv("CHUNK_SIZE", "1000")
+    kb.initialize()
+    assert "CHUNK_SIZE was measured in characters" in caplog.text
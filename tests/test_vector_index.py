@@ -0,0 +1,44 @@
+import pyarrow as pa
+from langchain.schema import Document
+
+from vector_index import HNSW_MAX_VECTORS, PQ_MIN_TRAINING_VECTORS, ArrowDocstore, index_factory_string
+
+def _documents(n):
+    return [
+        Document(page_content=f"chunk {i} " + "text " * 50,
+                 metadata={"source": "guide.pdf", "page": i // 10, "token_count": 52, "content_length": 260})
+        for i in range(n)
+    ]
+
+def test_docstore_round_trip(tmp_path):
+    path = str(tmp_path / "docstore.arrow")
+    ArrowDocstore.from_documents(_documents(20)).save(path)
+
+    docstore = ArrowDocstore.load(path)
+
+    assert len(docstore) == 20
+    doc = docstore.search("13")
+    assert doc.page_content.startswith("chunk 13 ")
+    assert doc.metadata == {"source": "guide.pdf", "page": 1, "chunk_id": 13, "token_count": 52, "content_length": 260}
+    assert docstore.search("20") == "ID 20 not found."
+
+def test_docstore_load_is_zero_copy(tmp_path):
+    path = str(tmp_path / "docstore.arrow")
+    ArrowDocstore.from_documents(_documents(5000)).save(path)
+
+    before = pa.total_allocated_bytes()
+    docstore = ArrowDocstore.load(path)
+
+    # Column buffers point into the mapped file instead of the Arrow heap
+    assert pa.total_allocated_bytes() - before < 64 * 1024
+    assert docstore.search("4999").page_content.startswith("chunk 4999 ")
+
+def test_auto_index_uses_hnsw_below_large_corpora():
+    assert index_factory_string(384, 6000) == "HNSW32"
+    assert index_factory_string(384, HNSW_MAX_VECTORS - 1) == "HNSW32"
+    assert index_factory_string(384, HNSW_MAX_VECTORS, nlist=256, pq_m=32) == "IVF256,PQ32x8"
+
+def test_ivfpq_needs_enough_points_to_train_codebooks():
+    assert PQ_MIN_TRAINING_VECTORS == 9984
+    assert index_factory_string(384, PQ_MIN_TRAINING_VECTORS - 1, index_type="ivfpq") == "Flat"
+    assert index_factory_string(384, PQ_MIN_TRAINING_VECTORS, index_type="ivfpq", nlist=256).startswith("IVF256,")
@@ -1,5 +1,6 @@
 import os
 import logging
+from dataclasses import dataclass
 from typing import Any, Optional
 
 def setup_logging(level: int = logging.INFO) -> logging.Logger:
@@ -51,4 +52,84 @@ def truncate_text(text: str, max_length: int = 100) -> str:
     """Truncate text to a maximum length"""
     if len(text) <= max_length:
         return text
-    return text[:max_length] + "..."
\ No newline at end of file
+    return text[:max_length] + "..."
+
+@dataclass(frozen=True)
+class Settings:
+    """Application settings, read from the environment once at startup"""
+    # LLM and embeddings
+    model_name: str = 'gpt-3.5-turbo'
+    embedding_model: str = 'text-embedding-ada-002'
+    embedding_backend: str = 'openai'
+    onnx_model_path: str = os.path.join('models', 'all-MiniLM-L6-v2')
+    embedding_precision: str = 'int8'
+    embedding_batch_size: int = 512
+    embedding_max_workers: int = 8
+    embedding_max_retries: int = 5
+    embedding_max_connections: int = 32
+    
+    # Document chunking, in tokens; named apart from the old character-based CHUNK_SIZE
+    chunk_tokens: int = 250
+    chunk_overlap_tokens: int = 25
+    
+    # Vector index
+    index_type: str = 'auto'
+    ivf_nlist: int = 256
+    pq_m: int = 32
+    train_sample_size: int = 100000
+    nprobe: int = 10
+    vector_precision: str = 'fp32'
+    
+    # Retrieval and query serving
+    retrieval_k: int = 5
+    # Exact in-process search below this many vectors; 0 keeps every query on the FAISS index
+    fast_retrieval_max: int = 0
+    cache_size: int = 1024
+    cache_ttl: float = 3600.0
+    batch_max_size: int = 64
+    batch_max_wait_ms: float = 10.0
+    
+    debug: bool = False
+    
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """
+        Build settings from environment variables, falling back to the defaults above
+        
+        Returns:
+            Settings populated from MODEL_NAME, EMBEDDING_MODEL, CHUNK_TOKENS, etc.
+        """
+        defaults = cls()
+        
+        def env(var_name: str, default: Any) -> str:
+            return get_env_variable(var_name, str(default))
+        
+        return cls(
+            model_name=env('MODEL_NAME', defaults.model_name),
+            embedding_model=env('EMBEDDING_MODEL', defaults.embedding_model),
+            embedding_backend=env('EMBEDDING_BACKEND', defaults.embedding_backend).lower(),
+            onnx_model_path=env('ONNX_MODEL_PATH', defaults.onnx_model_path),
+            embedding_precision=env('EMBEDDING_PRECISION', defaults.embedding_precision).lower(),
+            embedding_batch_size=int(env('EMBEDDING_BATCH_SIZE', defaults.embedding_batch_size)),
+            embedding_max_workers=int(env('EMBEDDING_MAX_WORKERS', defaults.embedding_max_workers)),
+            embedding_max_retries=int(env('EMBEDDING_MAX_RETRIES', defaults.embedding_max_retries)),
+            embedding_max_connections=int(env('EMBEDDING_MAX_CONNECTIONS', defaults.embedding_max_connections)),
+            chunk_tokens=int(env('CHUNK_TOKENS', defaults.chunk_tokens)),
+            chunk_overlap_tokens=int(env('CHUNK_OVERLAP_TOKENS', defaults.chunk_overlap_tokens)),
+            index_type=env('INDEX_TYPE', defaults.index_type).lower(),
+            ivf_nlist=int(env('IVF_NLIST', defaults.ivf_nlist)),
+            pq_m=int(env('PQ_M', defaults.pq_m)),
+            train_sample_size=int(env('TRAIN_SAMPLE_SIZE', defaults.train_sample_size)),
+            nprobe=int(env('NPROBE', defaults.nprobe)),
+            vector_precision=env('VECTOR_PRECISION', defaults.vector_precision).lower(),
+            retrieval_k=int(env('RETRIEVAL_K', defaults.retrieval_k)),
+            fast_retrieval_max=int(env('FAST_RETRIEVAL_MAX', defaults.fast_retrieval_max)),
+            cache_size=int(env('QUERY_CACHE_SIZE', defaults.cache_size)),
+            cache_ttl=float(env('QUERY_CACHE_TTL', defaults.cache_ttl)),
+            batch_max_size=int(env('BATCH_MAX_SIZE', defaults.batch_max_size)),
+            batch_max_wait_ms=float(env('BATCH_MAX_WAIT_MS', defaults.batch_max_wait_ms)),
+            debug=env('DEBUG', 'False').lower() == 'true'
+        )
+
+# Settings for this process; load .env before importing this module
+settings = Settings.from_env()
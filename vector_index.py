@@ -0,0 +1,216 @@
+import os
+import logging
+import argparse
+from collections.abc import Mapping
+from typing import Iterator, List, Optional, Union
+
+import faiss
+import numpy as np
+import pyarrow as pa
+from langchain.docstore.base import Docstore
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+# "auto" keeps full-precision HNSW below this many vectors and compresses with IVF-PQ above it
+HNSW_MAX_VECTORS = 100000
+
+# Bits per PQ code, i.e. 2**PQ_NBITS centroids per sub-quantizer codebook
+PQ_NBITS = 8
+
+# FAISS k-means wants 39 training points per centroid, so 256-centroid codebooks need 9,984
+PQ_MIN_TRAINING_VECTORS = 39 * 2 ** PQ_NBITS
+
+# Scalar quantizer codes for each stored vector precision
+SQ_FACTORY_CODES = {
+    "fp32": None,
+    "fp16": "SQfp16",
+    "bf16": "SQbf16",
+    "int8": "SQ8"
+}
+
+def _scalar_quantizer_code(precision: str) -> Optional[str]:
+    """Get the factory code for a vector precision, or None for full fp32"""
+    precision = precision.lower()
+    if precision not in SQ_FACTORY_CODES:
+        raise ValueError(f"Unsupported vector precision: {precision}")
+    if precision == "bf16" and not hasattr(faiss.ScalarQuantizer, "QT_bf16"):
+        logger.warning("This FAISS build has no bf16 scalar quantizer; storing vectors as fp16")
+        return SQ_FACTORY_CODES["fp16"]
+    return SQ_FACTORY_CODES[precision]
+
+def index_factory_string(dim: int, num_vectors: int, index_type: str = "auto",
+                         nlist: int = 100, pq_m: int = 32, precision: str = "fp32") -> str:
+    """
+    Choose a FAISS index_factory description for the corpus size
+
+    Args:
+        dim: Dimension of the embedding vectors
+        num_vectors: Number of vectors that will be indexed
+        index_type: One of "auto", "flat", "hnsw" or "ivfpq"
+        nlist: Number of IVF cells for "ivfpq"
+        pq_m: Number of PQ sub-quantizers for "ivfpq"
+        precision: Stored vector precision for "flat" and "hnsw" ("fp32", "fp16", "bf16" or "int8")
+
+    Returns:
+        Factory string accepted by faiss.index_factory
+    """
+    index_type = index_type.lower()
+    sq_code = _scalar_quantizer_code(precision)
+    if index_type == "auto":
+        index_type = "hnsw" if num_vectors < HNSW_MAX_VECTORS else "ivfpq"
+
+    if index_type == "flat":
+        return sq_code or "Flat"
+    if index_type == "hnsw":
+        return f"HNSW32,{sq_code}" if sq_code else "HNSW32"
+    if index_type == "ivfpq":
+        if num_vectors < PQ_MIN_TRAINING_VECTORS:
+            logger.warning(f"Only {num_vectors} vectors, too few to train IVF-PQ; using a flat index")
+            return sq_code or "Flat"
+        if dim % pq_m:
+            raise ValueError(f"Embedding dimension {dim} is not divisible by PQ size {pq_m}")
+        # Keep roughly 39 training points per cell, as FAISS recommends
+        nlist = max(1, min(nlist, num_vectors // 39))
+        # pq_m bytes per vector: one 8-bit code per sub-quantizer, scored with asymmetric distances
+        return f"IVF{nlist},PQ{pq_m}x{PQ_NBITS}"
+    raise ValueError(f"Unsupported index type: {index_type}")
+
+def build_index(vectors: np.ndarray, factory_string: str, train_sample_size: int = 100000) -> faiss.Index:
+    """Build, train and populate an L2 index from a (N, d) float32 matrix"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    logger.info(f"Building FAISS index {factory_string} over {vectors.shape[0]} vectors")
+    index = faiss.index_factory(vectors.shape[1], factory_string, faiss.METRIC_L2)
+    if not index.is_trained:
+        # Never sample below what the PQ codebooks need, whatever train_sample_size says
+        index.train(_training_sample(vectors, max(train_sample_size, PQ_MIN_TRAINING_VECTORS)))
+    index.add(vectors)
+    return index
+
+def _training_sample(vectors: np.ndarray, sample_size: int) -> np.ndarray:
+    """Pick a random subset of rows to train quantizers on"""
+    if len(vectors) <= sample_size:
+        return vectors
+    rows = np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)
+    return vectors[np.sort(rows)]
+
+def measure_recall(index: faiss.Index, vectors: np.ndarray, k: int = 5, num_queries: int = 100) -> float:
+    """
+    Estimate recall@k of an approximate index against exact search
+
+    Args:
+        index: Trained and populated index to evaluate
+        vectors: The (N, d) float32 matrix the index was built from
+        k: Number of neighbours compared per query
+        num_queries: Number of indexed vectors reused as sample queries
+
+    Returns:
+        Mean fraction of the exact top-k found by the index
+    """
+    queries = _training_sample(vectors, num_queries)
+    k = min(k, len(vectors))
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, expected = exact.search(queries, k)
+    _, found = index.search(queries, k)
+    hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+    return hits / float(expected.size)
+
+def set_search_params(index: faiss.Index, nprobe: int) -> None:
+    """Apply query-time parameters to an index, ignoring those it does not use"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+
+class ArrowDocstore(Docstore):
+    """Chunk text and metadata stored column-wise in an Arrow IPC file, addressed by index position"""
+
+    # Metadata columns stored alongside the chunk text
+    METADATA_COLUMNS = ("source", "page", "chunk_id", "token_count", "content_length")
+
+    def __init__(self, table: pa.Table):
+        """Wrap an Arrow table with a "text" column plus METADATA_COLUMNS"""
+        self.table = table
+        self._text = table.column("text")
+        self._metadata = {name: table.column(name) for name in self.METADATA_COLUMNS}
+
+    @classmethod
+    def from_documents(cls, documents: List[Document]) -> "ArrowDocstore":
+        """Build the columnar store from split chunks, numbering them in index order"""
+        columns = {
+            "text": pa.array([doc.page_content for doc in documents], type=pa.string()),
+            "source": pa.array([doc.metadata.get("source") for doc in documents], type=pa.string()),
+            "chunk_id": pa.array(range(len(documents)), type=pa.int64())
+        }
+        for name in ("page", "token_count", "content_length"):
+            columns[name] = pa.array([doc.metadata.get(name) for doc in documents], type=pa.int64())
+        return cls(pa.table(columns))
+
+    @classmethod
+    def load(cls, path: str) -> "ArrowDocstore":
+        """Open a saved store zero-copy; column buffers point into the mapped file and page in on access"""
+        with pa.ipc.open_file(pa.memory_map(path, "r")) as reader:
+            return cls(reader.read_all())
+
+    def save(self, path: str) -> None:
+        """Write the store as an uncompressed Arrow IPC file, so load() can map it without decoding"""
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, self.table.schema) as writer:
+                writer.write_table(self.table)
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def search(self, search: str) -> Union[str, Document]:
+        """Look up a document by its docstore id, which is its index position"""
+        i = int(search)
+        if not 0 <= i < self.table.num_rows:
+            return f"ID {search} not found."
+        metadata = {name: column[i].as_py() for name, column in self._metadata.items()}
+        return Document(page_content=self._text[i].as_py(), metadata=metadata)
+
+class PositionalIdMapping(Mapping):
+    """Maps index positions to docstore ids without materializing a dict"""
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def __getitem__(self, key: int) -> str:
+        if not 0 <= key < self.size:
+            raise KeyError(key)
+        return str(key)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.size))
+
+    def __len__(self) -> int:
+        return self.size
+
+def requantize_index(index: faiss.Index, precision: str) -> faiss.Index:
+    """Re-encode a flat fp32 index with a scalar quantizer at the given precision"""
+    if not isinstance(index, faiss.IndexFlat):
+        raise ValueError(f"Only flat indexes can be re-encoded, got {type(index).__name__}")
+    sq_code = _scalar_quantizer_code(precision)
+    if sq_code is None:
+        return index
+    return build_index(index.reconstruct_n(0, index.ntotal), sq_code)
+
+def migrate_index_file(path: str, precision: str = "int8") -> None:
+    """Rewrite a saved flat index file with scalar-quantized vectors"""
+    index = faiss.read_index(path)
+    logger.info(f"Re-encoding {index.ntotal} vectors in {path} as {precision}")
+    # Swap in a new file rather than overwriting one that running servers may have mapped
+    staging_path = f"{path}.tmp"
+    faiss.write_index(requantize_index(index, precision), staging_path)
+    os.replace(staging_path, path)
+
+if __name__ == '__main__':
+    from utils import setup_logging
+
+    parser = argparse.ArgumentParser(description="Re-encode a saved flat FAISS index with scalar quantization")
+    parser.add_argument("path", help="Path to the index.faiss file")
+    parser.add_argument("--precision", default="int8", choices=["fp16", "bf16", "int8"])
+    args = parser.parse_args()
+
+    setup_logging()
+    migrate_index_file(args.path, args.precision)